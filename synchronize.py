@@ -15,7 +15,7 @@ import socket
 import textwrap
 import time
 from base64 import b64encode
-from functools import reduce
+from functools import lru_cache, reduce
 from pathlib import Path
 from threading import Thread
 from typing import (
@@ -44,6 +44,11 @@ from paramiko.client import AutoAddPolicy
 from paramiko.file import BufferedFile
 from paramiko.ssh_exception import NoValidConnectionsError, SSHException
 
+try:  # use the faster LibYAML-based loader when available
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 # server names are constructed as
 #   vgcnbwc-{group_identifier}-{unique_id}
 PREFIX: str = "vgcnbwc-"
@@ -104,19 +109,26 @@ def print_streams(
     """
     print_functions = print_functions or [print] * len(streams)
     save = save or [True] * len(streams)
+    arguments = tuple(zip(streams, print_functions, save))
+    if not arguments:
+        return []
 
+    # The last stream is printed from the calling thread, which would otherwise
+    # sit idle waiting for the rest.
     with concurrent.futures.ThreadPoolExecutor(
-        max_workers=len(streams)
+        max_workers=max(len(arguments) - 1, 1)
     ) as executor:
         futures = [
             executor.submit(
                 print_stream, stream, print_function=function, save=save_stream
             )
-            for stream, function, save_stream in zip(
-                streams, print_functions, save
-            )
+            for stream, function, save_stream in arguments[:-1]
         ]
-        outputs = [future.result() for future in futures]
+        stream, function, save_stream = arguments[-1]
+        output = print_stream(
+            stream, print_function=function, save=save_stream
+        )
+        outputs = [future.result() for future in futures] + [output]
 
     return outputs
 
@@ -206,15 +218,15 @@ def unique_name(prefix: str, existing_names: Set[str] = None) -> str:
     existing ones.
 
     The name is constructed by appending`-XXXX` to a given prefix, where `XXXX`
-    is a left zero-padded random integer between 0000 and 9999. Names matching
-    any name provided in the set `existing_names` are discarded.
+    is the lowest left zero-padded integer between 0000 and 9999 such that the
+    name does not match any name provided in the set `existing_names`.
 
     Args:
         prefix: Prefix for constructing names.
         existing_names: List of existing server names to be avoided.
 
     Returns:
-        Unique name constructed from the given prefix and a random integer.
+        Unique name constructed from the given prefix and an integer.
 
     Raises:
         ValueError: All names that this function can generate are already
@@ -309,8 +321,8 @@ def condor_drain(
     try:
         stdout, stderr = remote_command(command, client, log=False)
     except RemoteCommandError as exception:
-        stdout = exception.stdout.decode("utf-8")
-        stderr = exception.stderr.decode("utf-8")
+        stdout = exception.stdout
+        stderr = exception.stderr
 
     if not any(
         (
@@ -609,7 +621,10 @@ def template_userdata(
     vars_from_files = (
         reduce(
             lambda x, y: x | y,
-            (yaml.safe_load(open(file, "r")) for file in vars_files),
+            (
+                yaml.load(Path(file).read_text(), Loader=SafeLoader)
+                for file in vars_files
+            ),
         )
         if vars_files
         else {}
@@ -641,6 +656,7 @@ def delete_and_wait(server, cloud, timeout=60, interval=2) -> None:
     cloud.compute.wait_for_delete(server, interval=interval, wait=timeout)
 
 
+@lru_cache(maxsize=128)
 def get_uuid(
     name_or_uuid: str,
     function: Callable[[str], Resource],
@@ -651,6 +667,9 @@ def get_uuid(
     as transformation. No transformation is applied if the input is already a
     UUID.
 
+    Results are cached, as the names and UUIDs of flavors, images and networks
+    do not change while the infrastructure is being synchronized.
+
     Args:
         name_or_uuid: String to convert to a resource UUID.
         function: Function that transforms resource names into resource UUIDs.
@@ -667,6 +686,7 @@ def get_uuid(
     return target
 
 
+@lru_cache(maxsize=128)
 def get_name(
     name_or_uuid: str,
     function: Callable[[str], Resource],
@@ -677,6 +697,8 @@ def get_name(
     as transformation. No transformation is applied if the input is already a
     name.
 
+    Results are cached, see `get_uuid`.
+
     Args:
         name_or_uuid: String to convert to a resource name.
         function: Function that transforms resource UUIDs into resource names.
@@ -1056,8 +1078,11 @@ if __name__ == "__main__":
         load_envvars=False,
     )
 
+    with open(command_args.resources_file) as resources_file:
+        config = yaml.load(resources_file, Loader=SafeLoader)
+
     synchronize_infrastructure(
-        config=yaml.safe_load(open(command_args.resources_file)),
+        config=config,
         user_data=command_args.userdata_file,
         cloud=openstack_cloud,
         dry_run=command_args.dry_run,
@@ -1,36 +1,44 @@
-"""Tests for the `synchronize` module."""
+"""Tests for the `synchronize` module.
+
+Tests that talk to OpenStack are marked with `openstack`. They spend most of
+their time waiting for the cloud, so they can be run in parallel with
+`pytest -n auto -m openstack` (requires `pytest-xdist`, which is not listed in
+requirements.txt, as the file is also installed on the test servers).
+"""
 import concurrent.futures
 import datetime
-import importlib
+import errno
 import io
-import ipaddress
 import logging
+import os
+import re
 import sys
+import tarfile
 import textwrap
 import time
 from base64 import b64encode
-from copy import deepcopy
-from multiprocessing import Event as MultiprocessingEvent
-from multiprocessing import Pipe, Process, Value
+from collections import deque
+from functools import cache, lru_cache
 from pathlib import Path
-from queue import Queue
 from socket import (
     AF_INET,
+    SHUT_WR,
+    SO_RCVBUF,
     SO_REUSEADDR,
+    SO_SNDBUF,
     SOCK_STREAM,
     SOL_SOCKET,
-    getfqdn,
     socket,
+    socketpair,
 )
 from socket import timeout as socket_timeout
 from tempfile import NamedTemporaryFile
-from threading import Lock, Thread
-from typing import List, Mapping, Optional, Type
+from threading import Condition, Event, Lock, Thread
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Type
 from uuid import uuid4
 
 import openstack
 import pytest
-import yaml
 from jinja2 import UndefinedError
 from openstack.compute.v2.server import Server
 from openstack.connection import Connection
@@ -49,7 +57,7 @@ from paramiko.common import (
     OPEN_SUCCEEDED,
 )
 from paramiko.file import BufferedFile
-from paramiko.ssh_exception import AuthenticationException
+from paramiko.ssh_exception import AuthenticationException, SSHException
 
 from synchronize import (
     PREFIX,
@@ -64,6 +72,8 @@ from synchronize import (
     create_server,
     delete_and_wait,
     filter_incorrect_images,
+    get_name,
+    get_uuid,
     gracefully_terminate,
     print_stream,
     print_streams,
@@ -82,7 +92,9 @@ IMAGE: str = "c6906a58-1e05-4be0-8f20-41f24c8320b5"  # Rocky 9.0
 IMAGE_NAME: str = "Rocky 9.0"
 REPLACEMENT_IMAGE: str = "682994d3-a0f4-4452-831c-9666a717e2ac"  # Rocky 8.5
 KEY: str = "kysrpex"
-NAME: str = CLOUD
+# Each pytest-xdist worker gets its own servers. The name is stable across
+# runs, so that servers left behind by an aborted run are noticed.
+NAME: str = f"{CLOUD}-{os.environ.get('PYTEST_XDIST_WORKER', 'main')}"
 NETWORK: str = "60775850-0c04-4a6d-b607-ad1d75ee2900"  # public
 SECGROUP: str = "default"
 USERNAME: str = "test"
@@ -92,6 +104,9 @@ USERNAME: str = "test"
 CLIENT_KEY: ECDSAKey = ECDSAKey.generate(bits=384)
 HOST_KEY: ECDSAKey = ECDSAKey.generate(bits=384)
 
+# Public key for the resource definitions used during the tests.
+PUBKEY: str = ECDSAKey.generate(bits=384).get_base64()
+
 
 def connect() -> Connection:
     """Connect to the OpenStack cloud."""
@@ -103,35 +118,122 @@ def connect() -> Connection:
     )
 
 
-def filter_group(
-    server: Mapping,
-    group: str,
-) -> bool:
-    """Filter a server by the group it belongs to.
+@lru_cache(maxsize=32)
+def group_prefix(group: str) -> str:
+    """Prefix of the names of the servers that belong to a group.
+
+    The prefix ends with the separator that precedes the unique suffix of the
+    names, so that a group does not match servers of another group whose name
+    merely starts with the same characters (e.g. `group-1` and `group-12`),
+    as it happens with the groups of different test processes.
+    """
+    return f"{PREFIX}{group}-"
+
+
+def deployed_servers(cloud: Connection, config: Mapping) -> List[Server]:
+    """List the servers that belong to any group of a resource definition.
 
-    Filters a server based on whether its name starts with a given prefix. The
-    goal to find out whether the server belongs to a group as it is defined in
-    resources.yaml.
+    Scans the servers once, matching their names against the prefixes of all
+    groups at the same time.
 
     Args:
-        server: Mapping with structure analogous to that of OpenStack `Server`
-            objects (which are an instances of Mapping).
-        group: Computing resources group name.
+        cloud: OpenStack connection to list the servers from.
+        config: Resource definition, as loaded from resources.yaml.
 
     Returns:
-        `True` when the server's name starts with the provided group name,
-        `False` otherwise.
+        Servers whose names start with the prefix of any of the groups.
     """
-    return server["name"].startswith(f"{PREFIX}{group}")
+    prefixes = tuple(group_prefix(group) for group in config["deployment"])
+    return [
+        server
+        for server in cloud.compute.servers()
+        if server["name"].startswith(prefixes)
+    ]
+
+
+@cache
+def server_user_data() -> str:
+    """Cloud-init user data for OpenStack servers spawned during the tests.
+
+    Adds the host and client keys to the user data. Both keys are generated
+    once per session, thus the result is computed only once.
+
+    Returns:
+        Base64-encoded cloud-init user data.
+    """
+    private_key = io.StringIO()
+    HOST_KEY.write_private_key(private_key)
+    private_key.seek(0)
+    private_key = private_key.read()
+    private_key = private_key.replace("\n", "\\n")
+    user_data = textwrap.dedent(
+        f"""
+        #cloud-config
+        # package_update: false
+        # package_upgrade: false
+        users:
+          - name: {USERNAME}
+            gecos: {USERNAME}
+            sudo: ALL=(ALL) NOPASSWD:ALL
+            groups: users, admin
+            ssh_authorized_keys:
+              - ecdsa-sha2-nistp384 {CLIENT_KEY.get_base64()}
+        ssh_keys:
+          ecdsa_public: ecdsa {HOST_KEY.get_base64()}
+          ecdsa_private: "{private_key}"
+    """
+    )[1:]
+    return b64encode(user_data.encode("utf-8")).decode("utf-8")
+
+
+def make_config(
+    *,
+    image: str = IMAGE,
+    flavor: str = FLAVOR,
+    network: str = NETWORK,
+    secgroup: str = SECGROUP,
+    sshkey: str = KEY,
+    graceful: bool = False,
+    count: int = 3,
+) -> Dict[str, Any]:
+    """Build a resource definition for the tests.
+
+    The resource definition mimics the contents of `resources.yaml` and
+    contains a single group of servers, `worker-{NAME}`. A fresh dictionary
+    is built on each call, so tests may modify it freely.
+
+    Args:
+        image: Default image for the servers.
+        flavor: Flavor for the servers of the group.
+        network: Network the servers are attached to.
+        secgroup: Security group for the servers.
+        sshkey: Name of the SSH key pair for the servers.
+        graceful: Whether to terminate servers gracefully.
+        count: Number of servers in the group.
+
+    Returns:
+        Resource definition.
+    """
+    return {
+        "images": {"default": image},
+        "network": network,
+        "secgroups": [secgroup],
+        "sshkey": sshkey,
+        "pubkeys": [PUBKEY],
+        "graceful": graceful,
+        "deployment": {
+            f"worker-{NAME}": {"count": count, "flavor": flavor},
+        },
+    }
 
 
 class BlockingStream(BufferedFile):
-    """A file-like wrapper around a pipe.
+    """A file-like wrapper around a socket pair.
 
     Writing to an instance of this object sends the data to the underlying
-    pipe. Reading from an instance of this object yields data from the pipe.
-    When the end of the pipe is reached the program blocks while waiting for
-    new data to come in.
+    socket pair. Reading from an instance of this object yields data from the
+    socket pair. When no data is available the program blocks while waiting
+    for new data to come in.
 
     This class is used to test `print_stream` and `print_streams`.
     """
@@ -140,66 +242,103 @@ class BlockingStream(BufferedFile):
         """Initialize the object.
 
         Configures the `BufferedFile` as readable, writable and opened in
-        binary mode, creates the underlying pipe, a "buffer" pipe to
-        temporarily store unread bytes, and a lock to prevent simultaneous
-        reads.
+        binary mode and creates the underlying socket pair. Unread bytes simply
+        stay in the socket until the next read.
+
+        Only one thread may read from the object at a time (e.g. the thread
+        running `print_stream`), thus reads are not synchronized.
         """
-        self._terminate = False
         self._flags = 0
         super().__init__()
         self._bufsize = 1
         self._flags |= BufferedFile.FLAG_READ
         self._flags |= BufferedFile.FLAG_WRITE
         self._flags |= BufferedFile.FLAG_BINARY
-        self._read_pipe, self._write_pipe = Pipe(duplex=False)
-        self._read_buffer, self._write_buffer = Pipe(duplex=False)
-        self._read_lock = Lock()
+        self._read_socket, self._write_socket = socketpair()
+        self._write_socket.setsockopt(SOL_SOCKET, SO_SNDBUF, 64 * 1024)
+        self._read_socket.setsockopt(SOL_SOCKET, SO_RCVBUF, 64 * 1024)
 
-    def _read(self, size: int) -> Optional[bytes]:
-        """Read from the underlying pipe.
+    def _read(self, size: int) -> bytes:
+        """Read from the underlying socket pair.
 
         Args:
-            size: Amount of bytes to read.
-        """
-        self._read_lock.acquire()
-
-        # previously read data (if any)
-        data = (
-            self._read_buffer.recv_bytes() if self._read_buffer.poll() else b""
-        )
-        if len(data) < size and not self._terminate:
-            # read from the pipe
-            data += self._read_pipe.recv_bytes()
-        # save unused data for later
-        self._write_buffer.send_bytes(data[size:])
-
-        if self._terminate:
-            # return EOF when `close` is called
-            return None
+            size: Maximum amount of bytes to read.
 
-        self._read_lock.release()
-
-        return data[0:size]
+        Returns:
+            The bytes read, or an empty bytes object (EOF) after `close` has
+            been called and all remaining data has been read.
+        """
+        if self._read_socket.fileno() == -1:  # EOF already reached
+            return b""
+        data = self._read_socket.recv(size)
+        if not data:
+            # nothing else can come in, release the reading end
+            self._read_socket.close()
+        return data
 
     def _write(self, data: bytes) -> int:
-        """Write to the underlying pipe.
+        """Write to the underlying socket pair.
 
         Args:
-            data: Amount of bytes to write to the pipe.
+            data: Amount of bytes to write to the socket pair.
 
         Returns:
-            Amount of bytes written to the pipe.
+            Amount of bytes written to the socket pair.
         """
-        self._write_pipe.send_bytes(data)
+        self._write_socket.sendall(data)
         return len(data)
 
     def close(self) -> None:
         """Close the file-like object."""
         super().close()
-        self._terminate = True
-        # write something to the pipe to unblock a potential in-progress pipe
-        # read
-        self._write_pipe.send_bytes(b"\n")
+        if self._write_socket.fileno() == -1:  # already closed
+            return
+        # shutting down the writing end makes potential in-progress (and
+        # future) reads return EOF
+        self._write_socket.shutdown(SHUT_WR)
+        self._write_socket.close()
+
+
+class FastQueue:
+    """A minimal unbounded FIFO queue for handing data between threads.
+
+    Unlike `queue.Queue`, which takes several locks and conditions per
+    operation, this queue is a `collections.deque` guarded by a single
+    condition variable.
+
+    This class is used to collect the output of `print_stream` and
+    `print_streams`.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the queue."""
+        self._items = deque()
+        self._condition = Condition()
+
+    def put(self, item: Any) -> None:
+        """Put an item into the queue.
+
+        Args:
+            item: Item to put into the queue.
+        """
+        with self._condition:
+            self._items.append(item)
+            self._condition.notify()
+
+    def get(self, block: bool = True) -> Any:
+        """Remove and return an item from the queue.
+
+        Args:
+            block: Wait until an item is available. When set to `False` and
+                the queue is empty, `IndexError` is raised.
+
+        Returns:
+            The oldest item in the queue.
+        """
+        with self._condition:
+            while block and not self._items:
+                self._condition.wait()
+            return self._items.popleft()
 
 
 class SSHServer(ServerInterface):
@@ -216,6 +355,12 @@ class SSHServer(ServerInterface):
 
     client_key: Optional[PKey] = None
 
+    # predefined commands and their stdout, stderr and exit status
+    commands: Mapping[bytes, Tuple[bytes, bytes, int]] = {
+        b"command": (b"text", b"error", 0),
+        b"fail": (b"fail_text", b"fail_error", 1),
+    }
+
     def __init__(self, client_key: Optional[PKey] = None):
         """Initialize the SSH server."""
         super().__init__()
@@ -254,30 +399,57 @@ class SSHServer(ServerInterface):
     ) -> bool:
         """Handle command execution requests.
 
-        Two predefined commands can be executed: "command" and "fail". The
-        former returns a zero exit code, while the latter returns a nonzero
-        exit code.
+        Only the predefined commands in `commands` can be executed. By
+        default, "command" returns a zero exit code, while "fail" returns a
+        nonzero exit code. Subclasses can extend `commands`.
         """
-        if command == b"command":
-            stdout = b"text"
-            stderr = b"error"
-            channel.send(stdout)
-            channel.send_stderr(stderr)
-            channel.send_exit_status(0)
-            channel.shutdown_write()
-            return True
-        elif command == b"fail":
-            stdout = b"fail_text"
-            stderr = b"fail_error"
+        reply = self.commands.get(command)
+        if reply is None:
+            self._reply(channel, status=1)
+            return False
+
+        stdout, stderr, status = reply
+        self._reply(channel, stdout=stdout, stderr=stderr, status=status)
+        return True
+
+    @staticmethod
+    def _reply(
+        channel: Channel,
+        stdout: bytes = b"",
+        stderr: bytes = b"",
+        status: int = 0,
+    ) -> None:
+        """Send the outputs and exit status of a command through a channel.
+
+        Empty outputs are skipped, as each call to `send` or `send_stderr`
+        results in an SSH packet even if there is no data to send.
+        """
+        if stdout:
             channel.send(stdout)
+        if stderr:
             channel.send_stderr(stderr)
-            channel.send_exit_status(1)
-            channel.shutdown_write()
-            return True
-
-        channel.send_exit_status(1)
+        channel.send_exit_status(status)
         channel.shutdown_write()
-        return False
+
+
+# Tells IP addresses apart from hostnames (IPv6 addresses contain at least one
+# colon, hostnames never do).
+IP_ADDRESS_PATTERN: re.Pattern = re.compile(
+    rb"^(\d{1,3}\.){3}\d{1,3}$|^[0-9a-fA-F]*:[0-9a-fA-F:]*$"
+)
+
+# Output of `condor_status | grep slot.*@{host}` on a mocked condor worker.
+CONDOR_STATUS_TEMPLATE: str = (
+    "slot1@{host}    "
+    "LINUX      X86_64 Unclaimed Idle      "
+    "0.000   33013 56+21:52:13\n"
+    "slot1_1@{host}  "
+    "LINUX      X86_64 Claimed   Idle      "
+    "0.000    4096 13+22:07:56\n"
+    "slot1_2@{host}  "
+    "LINUX      X86_64 Claimed   Idle      "
+    "0.000    4096  3+17:32:58\n"
+)
 
 
 class CondorServer(SSHServer):
@@ -291,6 +463,12 @@ class CondorServer(SSHServer):
     ip: str = "198.51.100.1"  # Prefix for examples (RFC5737)
     drained: bool = False
 
+    # `condor_status` outputs, precomputed for the hostname and the ip
+    _status_hostname: bytes = CONDOR_STATUS_TEMPLATE.format(
+        host=hostname
+    ).encode("utf-8")
+    _status_ip: bytes = CONDOR_STATUS_TEMPLATE.format(host=ip).encode("utf-8")
+
     def check_channel_exec_request(
         self, channel: Channel, command: bytes
     ) -> bool:
@@ -301,16 +479,12 @@ class CondorServer(SSHServer):
         )
         command = command.split()
 
-        mapping = {
-            b"condor_drain": self._handle_condor_drain,
-            b"condor_status": self._handle_condor_status,
-            b"condor_off": self._handle_condor_off,
-        }
-        for name, handler in mapping.items():
-            if command[0].endswith(name):
-                return handler(channel, command)
+        handler = _CONDOR_HANDLERS.get(command[0].rsplit(b"/", 1)[-1])
+        return handler(self, channel, command) if handler else False
 
-        return False
+    def reset(self) -> None:
+        """Restore the initial state of the mocked condor worker."""
+        self.drained = False
 
     def _handle_condor_drain(
         self, channel: Channel, command: List[bytes]
@@ -321,20 +495,19 @@ class CondorServer(SSHServer):
         the hostname of the machine to drain.
         """
         if len(command) > 2:
-            channel.send_stderr(
-                b"This is a mock server that pretends to run condor. "
-                b"It only accepts one positional argument for"
-                b"`condor_drain` (the machine to drain).\n"
+            self._reply(
+                channel,
+                stderr=(
+                    b"This is a mock server that pretends to run condor. "
+                    b"It only accepts one positional argument for"
+                    b"`condor_drain` (the machine to drain).\n"
+                ),
+                status=1,
             )
-            channel.send_exit_status(1)
-            channel.shutdown_write()
             return True
 
         # check whether an ip-address or a hostname has been provided
-        try:
-            ip_address = ipaddress.ip_address(command[1].decode("utf-8"))
-        except ValueError:
-            ip_address = None
+        ip_address = bool(IP_ADDRESS_PATTERN.match(command[1]))
 
         if any(
             (
@@ -345,26 +518,33 @@ class CondorServer(SSHServer):
             # when the correct ip address or hostname has been provided,
             # react to the drain command
             if self.drained:
-                channel.send_stderr(b"ERROR: Draining already in progress")
-                channel.send_exit_status(1)
+                self._reply(
+                    channel,
+                    stderr=b"ERROR: Draining already in progress",
+                    status=1,
+                )
             else:
                 self.drained = True
-                channel.send(
-                    b"Sent request to drain " + self.hostname.encode("utf-8")
+                self._reply(
+                    channel,
+                    stdout=(
+                        b"Sent request to drain "
+                        + self.hostname.encode("utf-8")
+                    ),
                 )
-                channel.send_exit_status(0)
         elif ip_address:
             # invalid IP address
-            channel.send_stderr(
-                b"ERROR: Can't find address for startd " + command[1]
+            self._reply(
+                channel,
+                stderr=b"ERROR: Can't find address for startd " + command[1],
+                status=1,
             )
-            channel.send_exit_status(1)
         else:
             # invalid hostname
-            channel.send_stderr(b"ERROR: unknown host " + command[1])
-            channel.send_exit_status(1)
+            self._reply(
+                channel, stderr=b"ERROR: unknown host " + command[1], status=1
+            )
 
-        channel.shutdown_write()
         return True
 
     def _handle_condor_status(
@@ -398,45 +578,31 @@ class CondorServer(SSHServer):
             )
         )
         if invalid:
-            channel.send_stderr(
-                b"This is a mock server that pretends to run condor. "
-                b"It only accepts the following condor_status command:"
-                b"`condor_status | grep slot.*@`hostname -f``\n"
+            self._reply(
+                channel,
+                stderr=(
+                    b"This is a mock server that pretends to run condor. "
+                    b"It only accepts the following condor_status command:"
+                    b"`condor_status | grep slot.*@`hostname -f``\n"
+                    + str(grep).encode()
+                ),
+                status=1,
             )
-            channel.send_stderr(str(grep).encode())
-            channel.send_exit_status(1)
-            channel.shutdown_write()
             return True
 
         host = command[3].split(b"@")[1]
-        try:
-            ip_address = ipaddress.ip_address(host.decode("utf-8"))
-        except ValueError:
-            ip_address = None
+        ip_address = bool(IP_ADDRESS_PATTERN.match(host))
         if (not ip_address and host == self.hostname.encode("utf-8")) or (
             ip_address and host == self.ip.encode("utf-8")
         ):
             status = (
-                (
-                    f"slot1@{self.hostname if not ip_address else self.ip}    "
-                    f"LINUX      X86_64 Unclaimed Idle      "
-                    f"0.000   33013 56+21:52:13\n"
-                    f"slot1_1@{self.hostname if not ip_address else self.ip}  "
-                    f"LINUX      X86_64 Claimed   Idle      "
-                    f"0.000    4096 13+22:07:56\n"
-                    f"slot1_2@{self.hostname if not ip_address else self.ip}  "
-                    f"LINUX      X86_64 Claimed   Idle      "
-                    f"0.000    4096  3+17:32:58\n"
-                )
+                (self._status_ip if ip_address else self._status_hostname)
                 if not self.drained
-                else ""
+                else b""
             )
         else:
-            status = ""
-        channel.send(status.encode("utf-8"))
-        channel.send_exit_status(0 if status else 1)
-
-        channel.shutdown_write()
+            status = b""
+        self._reply(channel, stdout=status, status=0 if status else 1)
         return True
 
     def _handle_condor_off(
@@ -448,104 +614,133 @@ class CondorServer(SSHServer):
 
         Any arguments are accepted, as they will be ignored.
         """
-        channel.send_exit_status(0)
-        channel.shutdown_write()
+        self._reply(channel)
         return True
 
 
+# Handlers for the commands that `CondorServer` accepts, keyed by the command's
+# basename.
+_CONDOR_HANDLERS = {
+    b"condor_drain": CondorServer._handle_condor_drain,
+    b"condor_status": CondorServer._handle_condor_status,
+    b"condor_off": CondorServer._handle_condor_off,
+}
+
+
 def launch_ssh_server(
-    port_number: Value,
-    event_port: MultiprocessingEvent,
-    event_termination: MultiprocessingEvent,
-    server_class: str = f"{__name__}.{SSHServer.__qualname__}",
+    server_socket: socket,
+    termination: Event,
+    server: ServerInterface,
 ) -> None:
     """Launches an SSH server implemented as a Python class.
 
-    Launches an SSH server and waits for a client to connect and run commands.
+    Launches an SSH server and waits for clients to connect and run commands.
+    Every incoming connection is served by the same instance of the class, so
+    that a single server can be reused across several connection attempts.
 
     Args:
-        port_number: This function is meant to run as a subprocess.
-            `port_number` is a variable shared with the parent process where
-            the function is meant to write the port number that has been chosen
-            for the server (it will be selected randomly). The parent process
-            can later read from this variable to connect to the selected port.
-        event_port: An event used to signal that a port has already been
-            selected and written to the shared variable `port_number`.
-        event_termination: An event used by the parent process to signal that
-            the server spawned by this function is no longer needed and can be
-            shutdown.
-        server_class: Python class implementing the SSH server.
+        server_socket: This function is meant to run in a thread.
+            `server_socket` is a socket, already listening, created by the
+            caller (thus the caller already knows the port number and can
+            connect right away).
+        termination: An event used by the caller to signal that the server
+            spawned by this function is no longer needed and can be shutdown.
+        server: Instance of the Python class implementing the SSH server.
     """
-    module, class_ = server_class.split(".")
-    server_class = getattr(importlib.import_module(module), class_)
-
-    # Create a socket.
-    server_socket = socket(AF_INET, SOCK_STREAM)
-    server_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-    server_socket.bind(("127.0.0.1", 0))  # randomly selected port number
+    transports: List[Transport] = []
 
-    # Share the selected port number with the parent process.
-    port_number.value = server_socket.getsockname()[1]
-    event_port.set()
-
-    # Wait for an incoming connection from an SSH client.
-    server_socket.listen(3600)
-    client, address = server_socket.accept()
-
-    # Use the connection to set up a transport.
-    transport = Transport(client)
-    transport.set_gss_host(getfqdn(""))
-    transport.load_server_moduli()
-    transport.add_server_key(HOST_KEY)
+    # Check periodically whether the caller wants to shut down the server.
+    server_socket.settimeout(1)
+    try:
+        while not termination.is_set():
+            # Wait for an incoming connection from an SSH client.
+            try:
+                client, address = server_socket.accept()
+            except socket_timeout:
+                continue
+            client.settimeout(None)
 
-    # Start a server over the transport.
-    server = server_class()
-    transport.start_server(server=server)
+            transport = None
+            try:
+                # Use the connection to set up a transport.
+                transport = Transport(client)
+                transport.load_server_moduli()
+                transport.add_server_key(HOST_KEY)
+
+                # Start a server over the transport (runs in its own thread).
+                transport.start_server(server=server)
+            except (SSHException, OSError):
+                # A failed handshake must not take the server down with it.
+                if transport is not None:
+                    transport.close()
+                client.close()
+                continue
+            transports.append(transport)
+    finally:
+        # Close the transports (and thus their channels) and the socket.
+        for transport in transports:
+            transport.close()
+        server_socket.close()
 
-    # Wait for the client to authenticate.
-    channel = transport.accept(timeout=3600)
 
-    # Wait for the parent process to signal that the SSH server is no longer
-    # needed.
-    event_termination.wait(timeout=3600)
+@pytest.fixture(scope="module")
+def ssh_server():
+    """Fixture returning a function that spawns an SSH server thread.
 
-    # Close the channel and the transport.
-    channel.close()
-    transport.close()
+    Servers that have not been shut down by the end of the module are
+    signaled to do so.
+    """
+    terminations: List[Event] = []
 
+    def function(
+        class_: Type[ServerInterface],
+    ) -> (ServerInterface, int, Event):
+        """Spawn an SSH server in a (daemon) thread.
 
-@pytest.fixture()
-def ssh_server():
-    """Fixture returning a function that spawns an SSH server subprocess."""
-
-    def function(class_: Type) -> (Process, int, MultiprocessingEvent):
-        """Spawn an SSH server in a subprocess."""
-        port = Value("I", 0)
-        event_port = MultiprocessingEvent()
-        event_termination = MultiprocessingEvent()
-        server = Process(
+        Returns the instance of `class_` handling the connection, the port the
+        server listens on, and an event that shuts the server down when set.
+        """
+        # Create a socket and start listening right away, so that the client
+        # can connect as soon as this function returns.
+        server_socket = socket(AF_INET, SOCK_STREAM)
+        server_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        server_socket.bind(("127.0.0.1", 0))  # randomly selected port number
+        server_socket.listen(3600)
+        port = server_socket.getsockname()[1]
+
+        server = class_()
+        termination = Event()
+        Thread(
             target=launch_ssh_server,
-            args=(
-                port,
-                event_port,
-                event_termination,
-                f"{__name__}.{class_.__qualname__}",
-            ),
-        )
-        server.start()
-        event_port.wait()
-        port = port.value
-        return server, port, event_termination
+            args=(server_socket, termination, server),
+            daemon=True,
+        ).start()
+        terminations.append(termination)
+        return server, port, termination
 
-    return function
+    yield function
 
+    for termination in terminations:
+        termination.set()
 
-@pytest.fixture()
+
+@pytest.fixture(scope="module")
 def ssh_client():
-    """Fixture returning a function that spawns and connects an SSH client."""
+    """Fixture returning a function that spawns and connects an SSH client.
+
+    Connected clients are cached by port and reused (as long as the connection
+    is still active) across the tests of a module, so that key exchange and
+    authentication happen once per server.
+    """
+    clients: Dict[int, SSHClient] = {}
 
     def function(port: int) -> SSHClient:
         """Spawn an SSH client and connect it to localhost."""
+        client = clients.get(port)
+        transport = client.get_transport() if client else None
+        if transport and transport.is_active():
+            return client
+
         client = SSHClient()
         client.get_host_keys().add(
             hostname=f"[127.0.0.1]:{port}",
@@ -560,68 +755,117 @@ def ssh_client():
             allow_agent=False,
             look_for_keys=False,
         )
+        clients[port] = client
         return client
 
-    return function
+    yield function
+
+    for client in clients.values():
+        client.close()
+
+
+@pytest.fixture(scope="module")
+def condor_connection(ssh_server, ssh_client):
+    """Fixture returning a `CondorServer` and a client connected to it.
+
+    The server and the connection are shared by all tests in the module.
+    """
+    server, port, termination = ssh_server(CondorServer)
+    return server, ssh_client(port)
 
 
 @pytest.fixture()
-def openstack_server():
-    """Fixture returning an OpenStack server."""
+def condor_ssh(condor_connection):
+    """Fixture returning the shared `CondorServer` and its client.
 
-    def function(cloud: Optional[Connection]) -> Server:
-        """Create an OpenStack server."""
-        cloud = cloud or connect()
+    The state of the server is reset after each test, so that every test
+    finds a pristine server without having to reset it itself.
+    """
+    server, client = condor_connection
+    yield server, client
+    server.reset()
+
+
+@pytest.fixture(scope="session")
+def openstack_cloud():
+    """Fixture returning a connection to the OpenStack cloud.
+
+    The connection (and thus the Keystone token and HTTP session) is shared by
+    all tests in the session.
+    """
+    cloud = connect()
+    yield cloud
+    cloud.close()
 
-        # Add host and client keys to userdata.
-        private_key = io.StringIO()
-        HOST_KEY.write_private_key(private_key)
-        private_key.seek(0)
-        private_key = private_key.read()
-        private_key = private_key.replace("\n", "\\n")
-        user_data = textwrap.dedent(
-            f"""
-            #cloud-config
-            # package_update: false
-            # package_upgrade: false
-            users:
-              - name: {USERNAME}
-                gecos: {USERNAME}
-                sudo: ALL=(ALL) NOPASSWD:ALL
-                groups: users, admin
-                ssh_authorized_keys:
-                  - ecdsa-sha2-nistp384 {CLIENT_KEY.get_base64()}
-            ssh_keys:
-              ecdsa_public: ecdsa {HOST_KEY.get_base64()}
-              ecdsa_private: "{private_key}"
-        """
-        )[1:]
 
-        return cloud.compute.create_server(
+@pytest.fixture(scope="session")
+def teardown_pool():
+    """Fixture returning a function to run teardown work in the background.
+
+    The function has the same signature as `Executor.submit`. Pending work is
+    waited for at the end of the session, and failures are reported then.
+    """
+    futures: List[concurrent.futures.Future] = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+
+        def submit(function, *args, **kwargs) -> concurrent.futures.Future:
+            """Run teardown work in the background and keep track of it."""
+            future = executor.submit(function, *args, **kwargs)
+            futures.append(future)
+            return future
+
+        yield submit
+
+    exceptions = [
+        future.exception() for future in futures if future.exception()
+    ]
+    for exception in exceptions:
+        logging.error("Teardown work failed.", exc_info=exception)
+    if exceptions:
+        raise RuntimeError(
+            f"{len(exceptions)} teardown task(s) failed (see the log)."
+        )
+
+
+@pytest.fixture()
+def openstack_server(openstack_cloud, teardown_pool):
+    """Fixture returning an OpenStack server.
+
+    Servers created through the fixture are deleted in the background after
+    the test finishes.
+    """
+    servers = []
+
+    def function() -> Server:
+        """Create an OpenStack server."""
+        server = openstack_cloud.compute.create_server(
             name=NAME,
             flavorRef=FLAVOR,
             imageRef=IMAGE,
             key_name=KEY,
             availability_zone=AVAILABILITY_ZONE,
             networks=[{"uuid": NETWORK}],
-            user_data=b64encode(user_data.encode("utf-8")).decode("utf-8"),
+            user_data=server_user_data(),
         )
+        servers.append(server)
+        return server
 
-    return function
+    yield function
+
+    for server in servers:
+        teardown_pool(delete_and_wait, server, openstack_cloud)
 
 
 @pytest.fixture()
-def openstack_condor_set_up():
+def openstack_condor_set_up(openstack_cloud):
     """Fixture that sets up an OpenStack server to mock Condor."""
     timeout_server_active: int = 30
     timeout_ssh_online: int = 30
     timeout_ssh_connect: int = 10
 
-    def function(
-        server: Server,
-        cloud: Connection,
-    ) -> None:
-        server = cloud.compute.wait_for_server(
+    def function(server: Server) -> None:
+        server = openstack_cloud.compute.wait_for_server(
             server,
             status="ACTIVE",
             interval=1,
@@ -639,6 +883,8 @@ def openstack_condor_set_up():
                 hostname=f"{ip}", keytype="ecdsa-sha2-nistp384", key=HOST_KEY
             )
 
+        # Retry with exponential backoff (50 ms doubling up to 2 s).
+        delay = 0.05
         start = time.time()
         while time.time() - start < timeout_ssh_online:
             try:
@@ -650,7 +896,8 @@ def openstack_condor_set_up():
                     pkey=CLIENT_KEY,
                 )
             except RuntimeError:
-                time.sleep(1)
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
                 continue
             break
         else:
@@ -675,14 +922,6 @@ def openstack_condor_set_up():
         CLIENT_KEY.write_private_key(private_key)
         private_key.seek(0)
 
-        sftp_client = client.open_sftp()
-        sftp_client.put(str(synchronize), f"/home/test/{synchronize.name}")
-        sftp_client.put(str(tests), f"/home/test/{tests.name}")
-        sftp_client.put(str(requirements), f"/home/test/{requirements.name}")
-        sftp_client.putfo(
-            io.BytesIO(private_key.read().encode("utf-8")),
-            "/home/test/client_key",
-        )
         python_script = textwrap.dedent(
             """
             #!/usr/bin/env python
@@ -691,7 +930,6 @@ def openstack_condor_set_up():
                 SO_REUSEADDR,
                 SOCK_STREAM,
                 SOL_SOCKET,
-                getfqdn,
                 socket,
             )
             from time import sleep
@@ -716,7 +954,6 @@ def openstack_condor_set_up():
             client, address = server_socket.accept()
 
             transport = Transport(client)
-            transport.set_gss_host(getfqdn(""))
             transport.load_server_moduli()
             transport.add_server_key(HOST_KEY)
 
@@ -730,28 +967,48 @@ def openstack_condor_set_up():
             transport.close()
         """
         )[1:]
-        sftp_client.putfo(
-            io.BytesIO(python_script.encode("utf-8")),
-            "/home/test/condor_server.py",
-        )
-        sftp_client.close()
+        # Upload all files at once as a tar archive streamed through a single
+        # remote command (instead of one SFTP round-trip per file).
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar_file:
+            tar_file.add(str(synchronize), arcname=synchronize.name)
+            tar_file.add(str(tests), arcname=tests.name)
+            tar_file.add(str(requirements), arcname=requirements.name)
+            for name, data in (
+                ("client_key", private_key.read().encode("utf-8")),
+                ("condor_server.py", python_script.encode("utf-8")),
+            ):
+                info = tarfile.TarInfo(name=name)
+                info.size = len(data)
+                tar_file.addfile(info, io.BytesIO(data))
+        stdin, stdout, stderr = client.exec_command("tar -xf - -C /home/test")
+        stdin.write(archive.getvalue())
+        stdin.channel.shutdown_write()
+        exit_code = stdout.channel.recv_exit_status()
+        if exit_code:
+            raise RuntimeError(
+                f"Could not upload files to {ip} (tar exited with code "
+                f"{exit_code})."
+            )
 
         try:
-            remote_command("sudo dnf install -y python3-pip", client, log=True)
             remote_command(
-                "sudo pip3 install -r /home/test/requirements.txt",
+                "set -euo pipefail; "
+                "sudo dnf install -y python3-pip && "
+                "sudo pip3 install -r /home/test/requirements.txt && "
+                "chmod +x /home/test/condor_server.py && "
+                "sudo systemctl stop sshd",
                 client,
                 log=True,
             )
-            remote_command(
-                "chmod +x /home/test/condor_server.py", client, log=True
-            )
-            remote_command("sudo systemctl stop sshd", client, log=True)
             client.exec_command("nohup sudo /home/test/condor_server.py &")
             remote_command(
-                "WAIT=0; "
-                "until [ -f /home/test/server_is_up ] || [ $WAIT -eq 30 ]; "
-                "do sleep $(( WAIT++ )); done",
+                "timeout 30 bash -c '"
+                "D=0.05; "
+                "until [ -f /home/test/server_is_up ]; "
+                "do sleep $D; "
+                'D=$(awk "BEGIN {d = $D * 2; print (d > 2) ? 2 : d}"); '
+                "done'",
                 client,
                 log=True,
             )
@@ -792,7 +1049,7 @@ def test_print_stream() -> None:
 
     # Allocate objects to handle stream contents.
     stdout = BlockingStream()  # the "program" writes here its stdout
-    queue_stdout = Queue()  # `print_stream` writes here
+    queue_stdout = FastQueue()  # `print_stream` writes here
 
     # Start the "program".
     lock = Lock()
@@ -810,16 +1067,14 @@ def test_print_stream() -> None:
     # Wait for the program to write to stdout and for the printer thread to
     # put the output in the queue. After everything is done, the queue should
     # contain "text1".
-    bytes_stdout = bytes()
-    bytes_stdout += queue_stdout.get(block=True)
+    bytes_stdout = queue_stdout.get(block=True)
     assert bytes_stdout == b"text1\n"
     # resume execution of the program
     lock.release()
 
     # Wait again for the program to write to stdout. It should now have
     # finished and thus written "text2" to stdout.
-    bytes_stdout = bytes()
-    bytes_stdout += queue_stdout.get(block=True)
+    bytes_stdout = queue_stdout.get(block=True)
     assert bytes_stdout == b"text2\n"
 
     # The printer thread is still running and waiting for input, so we close
@@ -831,7 +1086,7 @@ def test_print_stream() -> None:
     with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
         # Allocate objects to handle stream contents.
         stdout = BlockingStream()
-        queue_stdout = Queue()
+        queue_stdout = FastQueue()
 
         # Start the "program".
         lock = Lock()
@@ -871,34 +1126,35 @@ def test_print_streams() -> None:
     def program(
         program_stdout: BlockingStream,
         program_stderr: BlockingStream,
-        program_lock: Lock,
+        program_resume: Event,
     ) -> None:
         """Function simulating a running process (runs in a thread).
 
         Args:
             program_stdout: Stream simulating the program's stdout.
             program_stderr: Stream simulating the program's stderr.
-            program_lock: Lock for controlling the program from outside.
+            program_resume: Event for controlling the program from outside.
         """
         print("text1", file=program_stdout)
         print("error1", file=program_stderr)
-        program_lock.acquire()
+        program_resume.wait()
+        program_resume.clear()
         print("text2", file=program_stdout)
         print("error2", file=program_stderr)
-        program_lock.acquire()
+        program_resume.wait()
+        program_resume.clear()
         print("text3", file=program_stdout)
         print("error3", file=program_stderr)
 
     # Allocate objects to handle stream contents.
     stdout = BlockingStream()  # the "program" writes here its stdout
     stderr = BlockingStream()  # the "program" writes here its stderr
-    queue_stdout = Queue()  # `print_streams` writes here
-    queue_stderr = Queue()  # `print_streams` writes here
+    queue_stdout = FastQueue()  # `print_streams` writes here
+    queue_stderr = FastQueue()  # `print_streams` writes here
 
     # Start the "program".
-    lock = Lock()
-    lock.acquire()
-    thread = Thread(target=program, args=(stdout, stderr, lock))
+    resume = Event()
+    thread = Thread(target=program, args=(stdout, stderr, resume))
     thread.start()
 
     # Write the output in real time to queue objects (line-by-line).
@@ -918,32 +1174,26 @@ def test_print_streams() -> None:
     # Wait for the program to write to stdout and for the printer thread to
     # put the output in the queues. After everything is done, the stdout queue
     # should contain "text1" and the stderr queue should be empty.
-    bytes_stdout = bytes()
-    bytes_stdout += queue_stdout.get(block=True)
+    bytes_stdout = queue_stdout.get(block=True)
     assert bytes_stdout == b"text1\n"
-    bytes_stderr = bytes()
-    bytes_stderr += queue_stderr.get(block=True)
+    bytes_stderr = queue_stderr.get(block=True)
     assert bytes_stderr == b"error1\n"
     # resume execution of the program
-    lock.release()
+    resume.set()
 
     # Wait now for the program to write to stderr. It should be blocked waiting
-    # for the lock to be released and its stderr should contain "error".
-    bytes_stdout = bytes()
-    bytes_stdout += queue_stdout.get(block=True)
+    # for the event to be set and its stderr should contain "error".
+    bytes_stdout = queue_stdout.get(block=True)
     assert bytes_stdout == b"text2\n"
-    bytes_stderr = bytes()
-    bytes_stderr += queue_stderr.get(block=True)
+    bytes_stderr = queue_stderr.get(block=True)
     assert bytes_stderr == b"error2\n"
     # resume execution of the program
-    lock.release()
+    resume.set()
 
     # Now the program should have finished and written "text2" to stdout.
-    bytes_stdout = bytes()
-    bytes_stdout += queue_stdout.get(block=True)
+    bytes_stdout = queue_stdout.get(block=True)
     assert bytes_stdout == b"text3\n"
-    bytes_stderr = bytes()
-    bytes_stderr += queue_stderr.get(block=True)
+    bytes_stderr = queue_stderr.get(block=True)
     assert bytes_stderr == b"error3\n"
 
     # The printer thread is still running and waiting for input, so we close
@@ -953,43 +1203,61 @@ def test_print_streams() -> None:
     stderr.close()
 
     # Test saving the output.
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        # Allocate objects to handle stream contents.
-        stdout = BlockingStream()
-        stderr = BlockingStream()
-        queue_stdout = Queue()
-        queue_stderr = Queue()
+    # Allocate objects to handle stream contents.
+    stdout = BlockingStream()
+    stderr = BlockingStream()
+    buffer_stdout = bytearray()  # `print_streams` writes here
+    buffer_stderr = bytearray()  # `print_streams` writes here
+    line_stdout = Event()  # set by `print_streams` after each line
+    line_stderr = Event()  # set by `print_streams` after each line
 
-        # Start the "program".
-        lock = Lock()
-        lock.acquire()
-        thread = Thread(target=program, args=(stdout, stderr, lock))
-        thread.start()
+    def save_line(buffer: bytearray, event: Event) -> Callable[[bytes], None]:
+        """Print function appending lines to a buffer and signaling it."""
 
-        # Write the output to the queue object.
-        future = executor.submit(
-            print_streams,
-            (stdout, stderr),
-            print_functions=(
-                lambda line: queue_stdout.put(line),
-                lambda line: queue_stderr.put(line),
-            ),
-            save=(True, True),
+        def function(line: bytes) -> None:
+            buffer.extend(line)
+            buffer.extend(b"\n")
+            event.set()
+
+        return function
+
+    # Start the "program".
+    resume = Event()
+    thread = Thread(target=program, args=(stdout, stderr, resume))
+    thread.start()
+
+    # Write the output to the buffers.
+    outputs = []
+    printer = Thread(
+        target=lambda: outputs.append(
+            print_streams(
+                (stdout, stderr),
+                print_functions=(
+                    save_line(buffer_stdout, line_stdout),
+                    save_line(buffer_stderr, line_stderr),
+                ),
+                save=(True, True),
+            )
         )
+    )
+    printer.start()
 
-        # Wait for the contents to be processed by print_stream and then close
-        # the BlockingStream object.
-        for i in range(0, 3):  # (three lines expected)
-            queue_stdout.get(block=True)
-            queue_stderr.get(block=True)
-            lock.release()
-        stdout.close()
-        stderr.close()
+    # Wait for the contents to be processed by print_stream and then close
+    # the BlockingStream object.
+    for i in range(0, 3):  # (three lines expected)
+        line_stdout.wait()
+        line_stdout.clear()
+        line_stderr.wait()
+        line_stderr.clear()
+        resume.set()
+    stdout.close()
+    stderr.close()
 
-        stdout, stderr = future.result()
+    printer.join()
+    stdout, stderr = outputs[0]
 
-        assert stdout == b"text1\ntext2\ntext3\n"
-        assert stderr == b"error1\nerror2\nerror3\n"
+    assert stdout == bytes(buffer_stdout) == b"text1\ntext2\ntext3\n"
+    assert stderr == bytes(buffer_stderr) == b"error1\nerror2\nerror3\n"
 
 
 def test_remote_command(caplog, ssh_server, ssh_client) -> None:
@@ -1001,7 +1269,7 @@ def test_remote_command(caplog, ssh_server, ssh_client) -> None:
     caplog.set_level("DEBUG")
 
     # Test `log=False`
-    server, port, event_termination = ssh_server(SSHServer)
+    server, port, termination = ssh_server(SSHServer)
     client = ssh_client(port)
 
     stdout, stderr = remote_command("command", client, False)
@@ -1017,11 +1285,10 @@ def test_remote_command(caplog, ssh_server, ssh_client) -> None:
         assert b"fail_text" == exception_info.value.stdout
         assert b"fail_error" == exception_info.value.stderr
 
-    event_termination.set()
-    server.terminate()
+    termination.set()
 
     # Test `log=True`
-    server, port, event_termination = ssh_server(SSHServer)
+    server, port, termination = ssh_server(SSHServer)
     client = ssh_client(port)
 
     stdout, stderr = remote_command("command", client, True)
@@ -1038,24 +1305,24 @@ def test_remote_command(caplog, ssh_server, ssh_client) -> None:
     assert log_records[2].message == "error"
     assert log_records[2].levelname == "DEBUG"
 
-    event_termination.set()
-    server.terminate()
+    termination.set()
 
 
 def test_unique_name() -> None:
     """Test `unique_name`."""
     prefix = "vgcn-infrastructure-test-?18$98976👾"
-    existing_names = {f"{prefix}-0" f"{prefix}-0000" f"{prefix}-0001"}
+    existing_names = {f"{prefix}-0"} | {
+        f"{prefix}-{i:04d}" for i in range(0, 10)
+    }
 
-    name = unique_name(prefix)
+    name = unique_name(prefix, existing_names)
     assert type(name) == str
-    assert name.startswith(f"{prefix}-")
-    suffix = int(name[len(f"{prefix}-") :])
-    assert 0 <= suffix <= 9999
     assert name not in existing_names
+    # The lowest suffix not taken yet is picked.
+    assert name == f"{prefix}-0010"
 
 
-def test_connect_ssh(caplog, ssh_server, ssh_client) -> None:
+def test_connect_ssh(caplog, monkeypatch, ssh_server, ssh_client) -> None:
     """Test `connect_ssh`."""
     # Running `connect_ssh` on `server1` will always fail, because
     # all the IP addresses belong to unusable network prefixes.
@@ -1104,13 +1371,35 @@ def test_connect_ssh(caplog, ssh_server, ssh_client) -> None:
         },
     }
 
-    # Prepare an SSH client for the tests.
+    # Prepare an SSH client for the tests. A single SSH server serves both
+    # server2 subcases, so its host key is added to the client only once.
     client = SSHClient()
+    server, port, termination = ssh_server(SSHServer)
+    client.get_host_keys().add(
+        hostname=f"[127.0.0.1]:{port}",
+        keytype="ecdsa-sha2-nistp384",
+        key=HOST_KEY,
+    )
 
     # Test server1
     # ------------
     # The connection is expected to fail due to the hosts being unreachable
-    # (socket errors).
+    # (socket errors). Fail the connection attempts right away rather than
+    # depending on how the network of the machine running the tests handles
+    # these addresses (it may take until the timeout to fail).
+    unreachable = {
+        address["addr"]
+        for addresses in server1["addresses"].values()
+        for address in addresses
+    }
+    original_connect = socket.connect
+
+    def connect_unreachable(self: socket, address: Tuple) -> None:
+        if address[0] in unreachable:
+            raise OSError(errno.ENETUNREACH, os.strerror(errno.ENETUNREACH))
+        return original_connect(self, address)
+
+    monkeypatch.setattr(socket, "connect", connect_unreachable)
     # - verify that the correct exception is raised
     with pytest.raises(RuntimeError) as exception_info:
         connect_ssh(
@@ -1152,13 +1441,6 @@ def test_connect_ssh(caplog, ssh_server, ssh_client) -> None:
     # Test server2 (A)
     # The connection is expected to fail due to an authentication error.
     # ----------------
-    server, port, event_termination = ssh_server(SSHServer)
-    # - add the server's host key to the client
-    client.get_host_keys().add(
-        hostname=f"[127.0.0.1]:{port}",
-        keytype="ecdsa-sha2-nistp384",
-        key=HOST_KEY,
-    )
     # - run a test that will fail because the wrong username is provided
     with pytest.raises(RuntimeError) as exception_info:
         connect_ssh(
@@ -1186,18 +1468,10 @@ def test_connect_ssh(caplog, ssh_server, ssh_client) -> None:
         issubclass(record.exc_info[0], AuthenticationException)
         for record in log_records
     )
-    event_termination.set()
 
     # Test server2 (B)
     # The test should succeed.
     # ----------------
-    server, port, event_termination = ssh_server(SSHServer)
-    # - add the server's host key to the client
-    client.get_host_keys().add(
-        hostname=f"[127.0.0.1]:{port}",
-        keytype="ecdsa-sha2-nistp384",
-        key=HOST_KEY,
-    )
     # - attempt to connect
     ip = connect_ssh(
         client,
@@ -1207,75 +1481,64 @@ def test_connect_ssh(caplog, ssh_server, ssh_client) -> None:
         pkey=CLIENT_KEY,
         timeout=5,
     )
-    event_termination.set()
+    termination.set()
     assert ip == "127.0.0.1"
 
 
-def test_condor_drain(ssh_server, ssh_client) -> None:
-    """Test `condor_drain`."""
-    server, port, event_termination = ssh_server(CondorServer)
-    client = ssh_client(port)
+@pytest.mark.parametrize(
+    "function", (condor_drain, condor_off, condor_graceful_shutdown)
+)
+def test_condor_command(condor_ssh, function) -> None:
+    """Test `condor_drain`, `condor_off` and `condor_graceful_shutdown`.
 
-    condor_drain(client)
+    The functions just run a command on the server and raise an exception if
+    it does not succeed, thus they are all tested the same way.
+    """
+    server, client = condor_ssh
 
-    event_termination.set()
-    server.terminate()
+    function(client)
 
 
-def test_condor_active(ssh_server, ssh_client) -> None:
+def test_condor_active(condor_ssh) -> None:
     """Test `condor_active`."""
-    server, port, event_termination = ssh_server(CondorServer)
-    client = ssh_client(port)
+    server, client = condor_ssh
 
     assert condor_active(client)
 
     condor_drain(client)
     assert not condor_active(client)
 
-    event_termination.set()
-    server.terminate()
 
+def test_condor_drain_drained(condor_ssh) -> None:
+    """Test `condor_drain` on a worker that is already being drained.
 
-def test_condor_off(ssh_server, ssh_client) -> None:
-    """Test `condor_off`."""
-    server, port, event_termination = ssh_server(CondorServer)
-    client = ssh_client(port)
-
-    condor_off(client)
-
-    event_termination.set()
-    server.terminate()
-
-
-def test_condor_graceful_shutdown(ssh_client, ssh_server) -> None:
-    """Test `condor_graceful_shutdown`."""
-    server, port, event_termination = ssh_server(CondorServer)
-    client = ssh_client(port)
-
-    condor_graceful_shutdown(client)
+    The `condor_drain` command exits with an error when draining is already in
+    progress. The function must treat that as a successful drain.
+    """
+    server, client = condor_ssh
 
-    event_termination.set()
-    server.terminate()
+    condor_drain(client)
+    condor_drain(client)
+    assert server.drained
 
 
+@pytest.mark.openstack
 def test_gracefully_terminate(
-    openstack_server, openstack_condor_set_up
+    openstack_cloud, openstack_server, openstack_condor_set_up
 ) -> None:
     """Test `gracefully_terminate`."""
-    cloud = connect()
+    cloud = openstack_cloud
 
-    server = openstack_server(cloud)
-    try:
-        openstack_condor_set_up(server, cloud)
+    server = openstack_server()
+    openstack_condor_set_up(server)
 
-        gracefully_terminate(server, cloud, timeout=30, pkey=CLIENT_KEY)
-    finally:
-        delete_and_wait(server, cloud)
+    gracefully_terminate(server, cloud, timeout=30, pkey=CLIENT_KEY)
 
 
 def test_compute_increment() -> None:
     """Test `compute_increment`."""
     status = 4
+    today = datetime.date.today()
 
     group_config = {"count": 4}
     assert compute_increment(group_config, status) == 0
@@ -1288,58 +1551,71 @@ def test_compute_increment() -> None:
 
     group_config = {
         "count": 4,
-        "start": datetime.date.today(),
-        "end": datetime.date.today(),
+        "start": today,
+        "end": today,
     }
     assert compute_increment(group_config, status) == 0
 
     group_config = {
         "count": 8,
-        "start": datetime.date.today(),
-        "end": datetime.date.today(),
+        "start": today,
+        "end": today,
     }
     assert compute_increment(group_config, status) == 4
 
     group_config = {
         "count": 4,
-        "start": datetime.date.today() - datetime.timedelta(days=2),
-        "end": datetime.date.today() - datetime.timedelta(days=1),
+        "start": today - datetime.timedelta(days=2),
+        "end": today - datetime.timedelta(days=1),
     }
     assert compute_increment(group_config, status) == -4
 
     group_config = {
         "count": 4,
-        "start": datetime.date.today() + datetime.timedelta(days=1),
-        "end": datetime.date.today() + datetime.timedelta(days=2),
+        "start": today + datetime.timedelta(days=1),
+        "end": today + datetime.timedelta(days=2),
     }
     assert compute_increment(group_config, status) == -4
 
 
-def test_filter_incorrect_images() -> None:
+def test_get_uuid_and_name() -> None:
+    """Test `get_uuid` and `get_name`, including the caching of lookups."""
+    resource = {"id": str(uuid4()), "name": "resource"}
+    lookups = []
+
+    def find(name_or_uuid: str) -> Optional[Mapping]:
+        """Fake OpenStack `find_*` function that counts its calls."""
+        lookups.append(name_or_uuid)
+        if name_or_uuid in (resource["id"], resource["name"]):
+            return resource
+        return None
+
+    # Inputs that need no transformation are returned as they are.
+    assert get_uuid(resource["id"], find) == resource["id"]
+    assert get_name(resource["name"], find) == resource["name"]
+    assert lookups == []
+
+    # Repeated lookups reach `find` only once.
+    assert get_uuid(resource["name"], find) == resource["id"]
+    assert get_uuid(resource["name"], find) == resource["id"]
+    assert get_name(resource["id"], find) == resource["name"]
+    assert get_name(resource["id"], find) == resource["name"]
+    assert lookups == [resource["name"], resource["id"]]
+
+    # Failed lookups are not cached.
+    lookups.clear()
+    for i in range(0, 2):
+        with pytest.raises(TypeError):
+            get_uuid("missing", find)
+    assert lookups == ["missing", "missing"]
+
+
+@pytest.mark.openstack
+def test_filter_incorrect_images(openstack_cloud) -> None:
     """Test `filter_incorrect_images`."""
-    cloud = connect()
+    cloud = openstack_cloud
 
-    config_string = textwrap.dedent(
-        f"""
-        ---
-        images:
-            default: {IMAGE}
-        network: {NETWORK}
-        secgroups:
-            - {SECGROUP}
-        sshkey: {KEY}
-        pubkeys:
-          - "{ECDSAKey.generate(bits=384).get_base64()}"
-
-        graceful: false
-
-        deployment:
-          worker-{NAME}:
-            count: 3
-            flavor: {uuid4()}
-    """
-    )[1:]
-    config = yaml.safe_load(config_string)
+    config = make_config(flavor=str(uuid4()))
     group = next(iter(config["deployment"]))
     group_config = config["deployment"][group]
 
@@ -1360,15 +1636,16 @@ def test_filter_incorrect_images() -> None:
     ]
 
     # Test image name.
-    modified_config = deepcopy(config)
-    modified_config["images"]["default"] = IMAGE_NAME
+    modified_config = {**config, "images": {"default": IMAGE_NAME}}
     assert filter_incorrect_images(
         servers, modified_config, group_config, cloud
     ) == [servers[1]]
 
     # Test invalid image name.
-    modified_config = deepcopy(config)
-    modified_config["images"]["default"] = NAME + "invalid_image_name"
+    modified_config = {
+        **config,
+        "images": {"default": NAME + "invalid_image_name"},
+    }
     with pytest.raises(TypeError):
         filter_incorrect_images(servers, modified_config, group_config, cloud)
 
@@ -1384,51 +1661,36 @@ def test_filter_incorrect_images() -> None:
     ]
 
 
-def test_remove_server(openstack_server, openstack_condor_set_up) -> None:
+@pytest.mark.openstack
+def test_remove_server(
+    openstack_cloud, openstack_server, openstack_condor_set_up
+) -> None:
     """Test `remove_server`."""
-    cloud = connect()
+    cloud = openstack_cloud
 
-    server = openstack_server(cloud)
-    try:
-        openstack_condor_set_up(server, cloud)
+    server = openstack_server()
+    openstack_condor_set_up(server)
 
-        config = {"graceful": True}
-        remove_server(server, config, cloud, pkey=CLIENT_KEY)
-    finally:
-        delete_and_wait(server, cloud)
+    config = {"graceful": True}
+    remove_server(server, config, cloud, pkey=CLIENT_KEY)
 
-    server = openstack_server(cloud)
-    try:
-        openstack_condor_set_up(server, cloud)
+    server = openstack_server()
+    openstack_condor_set_up(server)
 
-        config = {"graceful": False}
-        remove_server(server, config, cloud)
-    finally:
-        delete_and_wait(server, cloud)
+    config = {"graceful": False}
+    remove_server(server, config, cloud)
 
 
 def test_template_userdata() -> None:
     """Test `template_userdata`."""
-    config_string = textwrap.dedent(
-        f"""
-        ---
-        images:
-            default: {uuid4()}
-        network: default
-        secgroups:
-            - secgroup
-        sshkey: key
-        pubkeys:
-          - "{ECDSAKey.generate(bits=384).get_base64()}"
-
-        graceful: true
-
-        deployment:
-          worker-{NAME}:
-            count: 3
-            flavor: {uuid4()}
-    """
-    )[1:]
+    config = make_config(
+        image=str(uuid4()),
+        flavor=str(uuid4()),
+        network="default",
+        secgroup="secgroup",
+        sshkey="key",
+        graceful=True,
+    )
 
     user_data = textwrap.dedent(
         """
@@ -1451,27 +1713,9 @@ def test_template_userdata() -> None:
     """
     )[1:]
 
-    config = yaml.safe_load(config_string)
     group = next(iter(config["deployment"]))
     group_config = config["deployment"][group]
 
-    # Successful rendering.
-    with NamedTemporaryFile("w") as user_data_file, NamedTemporaryFile(
-        "w"
-    ) as vars_file:
-        user_data_file.write(user_data)
-        user_data_file.flush()
-
-        vars_file.write(variables)
-        vars_file.flush()
-
-        templated = template_userdata(
-            unique_name(group, set()),
-            config,
-            group_config,
-            Path(user_data_file.name),
-            (Path(vars_file.name),),
-        )
     expected = textwrap.dedent(
         """
         #cloud-config
@@ -1485,61 +1729,55 @@ def test_template_userdata() -> None:
             docker: False
     """
     )[1:-1]
-    assert templated == expected
 
-    # Missing variables: exception expected.
-    with NamedTemporaryFile("w") as user_data_file, pytest.raises(
-        UndefinedError
-    ):
+    # Write the template and the variables once for all cases.
+    with NamedTemporaryFile("w") as user_data_file, NamedTemporaryFile(
+        "w"
+    ) as vars_file:
         user_data_file.write(user_data)
         user_data_file.flush()
 
-        template_userdata(
+        vars_file.write(variables)
+        vars_file.flush()
+
+        # Successful rendering.
+        templated = template_userdata(
             unique_name(group, set()),
             config,
             group_config,
             Path(user_data_file.name),
+            (Path(vars_file.name),),
         )
+        assert templated == expected
+
+        # Missing variables: exception expected.
+        with pytest.raises(UndefinedError):
+            template_userdata(
+                unique_name(group, set()),
+                config,
+                group_config,
+                Path(user_data_file.name),
+            )
 
 
-def test_delete_and_wait(openstack_server) -> None:
+@pytest.mark.openstack
+def test_delete_and_wait(openstack_cloud, openstack_server) -> None:
     """Test `delete_and_wait`."""
-    cloud = connect()
+    cloud = openstack_cloud
 
-    server = openstack_server(cloud=cloud)
-    try:
-        assert cloud.compute.find_server(server["id"]) is not None
-        assert cloud.compute.find_server(server["id"])["id"] == server["id"]
-        delete_and_wait(server, cloud)
-        assert cloud.compute.find_server(server["id"]) is None
-    finally:
-        cloud.compute.delete_server(server)
+    server = openstack_server()
+    assert cloud.compute.find_server(server["id"]) is not None
+    assert cloud.compute.find_server(server["id"])["id"] == server["id"]
+    delete_and_wait(server, cloud)
+    assert cloud.compute.find_server(server["id"]) is None
 
 
-def test_create_server() -> None:
+@pytest.mark.openstack
+def test_create_server(openstack_cloud) -> None:
     """Test `create_server`."""
-    cloud = connect()
+    cloud = openstack_cloud
 
-    config_string = textwrap.dedent(
-        f"""
-        ---
-        images:
-            default: {IMAGE}
-        network: {NETWORK}
-        secgroups:
-            - {SECGROUP}
-        sshkey: {KEY}
-        pubkeys:
-          - "{ECDSAKey.generate(bits=384).get_base64()}"
-
-        graceful: false
-
-        deployment:
-          worker-{NAME}:
-            count: 3
-            flavor: {FLAVOR}
-        """
-    )[1:]
+    config = make_config()
 
     user_data = textwrap.dedent(
         """
@@ -1561,7 +1799,6 @@ def test_create_server() -> None:
     """
     )[1:]
 
-    config = yaml.safe_load(config_string)
     group = next(iter(config["deployment"]))
     group_config = config["deployment"][group]
 
@@ -1586,80 +1823,43 @@ def test_create_server() -> None:
         delete_and_wait(server, cloud)
 
 
-def test_synchronize_infrastructure() -> None:
+@pytest.mark.openstack
+def test_synchronize_infrastructure(openstack_cloud) -> None:
     """Test `synchronize_infrastructure`."""
-    cloud = connect()
+    cloud = openstack_cloud
 
-    config_string = textwrap.dedent(
-        f"""
-        ---
-        images:
-            default: {IMAGE}
-        network: {NETWORK}
-        secgroups:
-            - {SECGROUP}
-        sshkey: {KEY}
-        pubkeys:
-          - "{ECDSAKey.generate(bits=384).get_base64()}"
-
-        graceful: false
-
-        deployment:
-          worker-{NAME}:
-            count: 3
-            flavor: {FLAVOR}
+    config = make_config()
+
+    def assert_deployed(count: int, image: Optional[str] = None) -> None:
+        """Check the servers deployed for `config` (one listing per call).
+
+        Args:
+            count: Expected number of servers.
+            image: Expected image of the servers, if any.
         """
-    )[1:]
-    config = yaml.safe_load(config_string)
+        servers = deployed_servers(cloud, config)
+        assert len(servers) == count
+        if image is not None:
+            assert all(server["image"]["id"] == image for server in servers)
+
     try:
         # Verify initial status.
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
-        assert len(servers) == 0
+        assert_deployed(0)
 
         # Test adding servers.
         synchronize_infrastructure(
             config, cloud, user_data=None, vars_files=set(), dry_run=False
         )
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
-        assert len(servers) == 3
-
-        # Test no changes.
+        assert_deployed(3)
+
+        # Test no changes (the servers still use the original image).
         synchronize_infrastructure(
             config, cloud, user_data=None, vars_files=set(), dry_run=False
         )
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
-        assert len(servers) == 3
+        assert_deployed(3, image=IMAGE)
 
         # Test replace image.
-        modified_config = deepcopy(config)
-        modified_config["images"]["default"] = REPLACEMENT_IMAGE
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
-        assert len(servers) == 3
-        assert all(server["image"]["id"] == IMAGE for server in servers)
+        modified_config = {**config, "images": {"default": REPLACEMENT_IMAGE}}
         synchronize_infrastructure(
             modified_config,
             cloud,
@@ -1667,22 +1867,16 @@ def test_synchronize_infrastructure() -> None:
             vars_files=set(),
             dry_run=False,
         )
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
-        assert len(servers) == 3
-        assert all(
-            server["image"]["id"] == REPLACEMENT_IMAGE for server in servers
-        )
+        assert_deployed(3, image=REPLACEMENT_IMAGE)
 
         # Test removing servers.
-        modified_config = deepcopy(config)
-        for group in config["deployment"]:
-            modified_config["deployment"][group]["count"] = 0
+        modified_config = {
+            **config,
+            "deployment": {
+                group: {**group_config, "count": 0}
+                for group, group_config in config["deployment"].items()
+            },
+        }
         synchronize_infrastructure(
             modified_config,
             cloud,
@@ -1690,24 +1884,21 @@ def test_synchronize_infrastructure() -> None:
             vars_files=set(),
             dry_run=False,
         )
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
-        assert len(servers) == 0
+        assert_deployed(0)
 
         # Test invalid date.
-        modified_config = deepcopy(config)
-        for group in config["deployment"]:
-            modified_config["deployment"][group][
-                "start"
-            ] = datetime.date.today() - datetime.timedelta(days=2)
-            modified_config["deployment"][group][
-                "end"
-            ] = datetime.date.today() - datetime.timedelta(days=1)
+        modified_config = {
+            **config,
+            "deployment": {
+                group: {
+                    **group_config,
+                    "start": datetime.date.today()
+                    - datetime.timedelta(days=2),
+                    "end": datetime.date.today() - datetime.timedelta(days=1),
+                }
+                for group, group_config in config["deployment"].items()
+            },
+        }
         synchronize_infrastructure(
             modified_config,
             cloud,
@@ -1715,24 +1906,21 @@ def test_synchronize_infrastructure() -> None:
             vars_files=set(),
             dry_run=False,
         )
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
-        assert len(servers) == 0
+        assert_deployed(0)
 
         # Test valid date.
-        modified_config = deepcopy(config)
-        for group in config["deployment"]:
-            modified_config["deployment"][group][
-                "start"
-            ] = datetime.date.today() - datetime.timedelta(days=1)
-            modified_config["deployment"][group][
-                "end"
-            ] = datetime.date.today() + datetime.timedelta(days=1)
+        modified_config = {
+            **config,
+            "deployment": {
+                group: {
+                    **group_config,
+                    "start": datetime.date.today()
+                    - datetime.timedelta(days=1),
+                    "end": datetime.date.today() + datetime.timedelta(days=1),
+                }
+                for group, group_config in config["deployment"].items()
+            },
+        }
         synchronize_infrastructure(
             modified_config,
             cloud,
@@ -1740,22 +1928,9 @@ def test_synchronize_infrastructure() -> None:
             vars_files=set(),
             dry_run=False,
         )
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
-        assert len(servers) == 3
+        assert_deployed(3)
     finally:
-        servers = list(cloud.compute.servers())
-        servers = [
-            server
-            for group in config["deployment"]
-            for server in servers
-            if filter_group(server, group)
-        ]
+        servers = deployed_servers(cloud, config)
         for server in servers:
             delete_and_wait(server, cloud)
 